@@ -1,22 +1,211 @@
-import json
 import os
 import platform
-import re
+import selectors
 import shlex
 import shutil
 import subprocess
 import sys
-import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
-import box
-import jsonschema
 from box import Box
-from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
 
 from ffprobe import StreamInfo, Ffprobe
 
+if TYPE_CHECKING:
+    from jsonschema.protocols import Validator
+    from rich.progress import Progress, TaskID
+
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+_PROGRESS_FRAME_KEY = b"frame="
+_FASTJSONSCHEMA_DRAFTS = ("/draft-04/", "/draft-06/", "/draft-07/")
+
+
+class _SchemaValidator:
+    """A JSON schema compiled once and reused for every validation.
+
+    When `fastjsonschema` is installed and the schema declares a draft it supports (draft-04, draft-06 or
+    draft-07) the schema is also compiled into a plain Python function which is used to accept valid data
+    quickly.  Anything it rejects is re-checked with `jsonschema` so the error raised is always a
+    `jsonschema.ValidationError`.
+
+    Attributes:
+        validator (jsonschema.protocols.Validator): The `jsonschema` validator for the schema.
+        fast_validate (Callable[[Any], Any], optional): The `fastjsonschema` validation function. Defaults to None.
+    """
+
+    __slots__ = ("validator", "fast_validate")
+
+    validator: "Validator"
+    fast_validate: Optional[Callable[[Any], Any]]
+
+    def __init__(self, schema_path: Path):
+        """Load, check and compile the JSON schema.
+
+        Args:
+            schema_path (Path): The location of the JSON schema file.
+        """
+        import jsonschema
+
+        schema_data = _json_loads(schema_path.read_bytes())
+        cls = jsonschema.validators.validator_for(schema_data)
+        cls.check_schema(schema_data)
+        self.validator = cls(schema_data)
+
+        # `fastjsonschema` treats any draft it doesn't know (e.g. 2020-12) as draft-07 and silently skips newer
+        # keywords, so only use it when the schema declares one of the drafts it implements.
+        self.fast_validate = None
+        if any(draft in schema_data.get("$schema", "") for draft in _FASTJSONSCHEMA_DRAFTS):
+            try:
+                import fastjsonschema
+            except ImportError:
+                pass
+            else:
+                self.fast_validate = fastjsonschema.compile(schema_data, use_default=False)
+
+    def validate(self, data: Union[Box, dict]) -> None:
+        """Validate the data against the schema.
+
+        Args:
+            data (Union[Box, dict]): The data to validate.
+
+        Raises:
+            jsonschema.ValidationError: If the data does not pass validation.
+        """
+        if self.fast_validate is not None:
+            import fastjsonschema
+
+            try:
+                self.fast_validate(data)
+                return
+            except fastjsonschema.JsonSchemaException:
+                pass
+
+        import jsonschema
+
+        if error := jsonschema.exceptions.best_match(self.validator.iter_errors(data)):
+            raise error
+
+
+_SCHEMA_VALIDATORS: Dict[Path, _SchemaValidator] = dict()
+
+
+def _get_validator(schema_path: Path) -> _SchemaValidator:
+    """Return the compiled validator for a JSON schema, compiling it on first use.
+
+    Args:
+        schema_path (Path): The location of the JSON schema file.
+
+    Returns:
+        _SchemaValidator: The compiled validator for the schema.
+    """
+    if schema_path not in _SCHEMA_VALIDATORS:
+        _SCHEMA_VALIDATORS[schema_path] = _SchemaValidator(schema_path)
+    return _SCHEMA_VALIDATORS[schema_path]
+
+
+def _parse_frame(line: bytes) -> Optional[int]:
+    """Parse the frame count out of a line of `ffmpeg` `-progress` output.
+
+    Args:
+        line (bytes): A `key=value` line from the `-progress` output.
+
+    Returns:
+        Optional[int]: The current frame if the line is a frame count. Defaults to None.
+    """
+    if line.startswith(_PROGRESS_FRAME_KEY):
+        frame = line[len(_PROGRESS_FRAME_KEY):].strip()
+        if frame.isdigit():
+            return int(frame)
+    return None
+
+
+def _progress_bar() -> "Progress":
+    """Create the progress bar used to display encode progress.
+
+    Returns:
+        Progress: The (not yet started) progress bar.
+    """
+    from rich.progress import BarColumn, Progress, TextColumn, TimeRemainingColumn
+
+    return Progress(
+        TextColumn("[#ffff00]»[bold green] {task.description}"),
+        BarColumn(
+            bar_width=None,
+        ),
+        "[progress.percentage]{task.percentage:>3.1f}%",
+        "•",
+        "[green]{task.completed}/{task.total}[/green]",
+        "•",
+        TimeRemainingColumn(),
+    )
+
+
+@lru_cache(maxsize=4)
+def _resolve_ffmpeg(binary: str) -> Path:
+    """Find an `ffmpeg` binary on the PATH, only scanning the PATH the first time a binary is looked up.
+
+    Args:
+        binary (str): The name of the `ffmpeg` binary.
+
+    Returns:
+        Path: The location of the `ffmpeg` binary.
+    """
+    return Path(shutil.which(binary))
+
+
+def _probe(media_path: Union[str, Path]) -> Ffprobe:
+    """Probe a media file, reusing the result if the same file was already probed and hasn't changed since.
+
+    Args:
+        media_path (Union[str, Path]): The media file to probe.
+
+    Returns:
+        Ffprobe: The `ffprobe` information for the media file.
+    """
+    try:
+        path = Path(media_path).resolve()
+        modified = path.stat().st_mtime_ns
+    except OSError:
+        # Not a local file (e.g. a URL), so there's nothing to key the cache on.
+        return _run_probe(media_path)
+    return _probe_file(path, modified)
+
+
+@lru_cache(maxsize=32)
+def _probe_file(media_path: Path, modified: int) -> Ffprobe:
+    """Probe a local media file, caching the result by its resolved path and modification time.
+
+    Args:
+        media_path (Path): The resolved path to the media file.
+        modified (int): The modification time of the media file in nanoseconds.
+
+    Returns:
+        Ffprobe: The `ffprobe` information for the media file.
+    """
+    return _run_probe(media_path)
+
+
+def _run_probe(media_path: Union[str, Path]) -> Ffprobe:
+    """Probe a media file.
+
+    Args:
+        media_path (Union[str, Path]): The media file to probe.
+
+    Returns:
+        Ffprobe: The `ffprobe` information for the media file.
+    """
+    info = Ffprobe(media_path)
+    info.streams  # Run `ffprobe` now so it happens on the calling (worker) thread.
+    return info
+
 
 class SourceMap:
     """A map of sources for `ffmpeg` to use for streams
@@ -27,6 +216,8 @@ class SourceMap:
         stream (int, optional): The zero index of the stream in the file to map. Defaults to None.
         optional (bool): Whether the track is ignored if it does not exist. Defaults to False.
     """
+    __slots__ = ("source", "specifier", "stream", "optional")
+
     source: int
     specifier: Optional[str]
     stream: Optional[int]
@@ -53,6 +244,15 @@ class SourceMap:
         Returns:
             str: The CLI options for the `ffmpeg` source map
         """
+        return ' '.join(self.cli_argv)
+
+    @property
+    def cli_argv(self) -> List[str]:
+        """Returns the `ffmpeg` CLI options associated with this source map as separate arguments
+
+        Returns:
+            List[str]: The CLI arguments for the `ffmpeg` source map
+        """
         o = [f"{self.source}"]
         if self.specifier:
             o.append(f":{self.specifier}")
@@ -60,7 +260,7 @@ class SourceMap:
             o.append(f":{self.stream}")
         if self.optional:
             o.append("?")
-        return f"-map {''.join(o)}"
+        return ["-map", ''.join(o)]
 
 
 class OutputMap:
@@ -69,13 +269,16 @@ class OutputMap:
     Attributes:
         specifier (str, optional): The type of stream denoted by a single character. Defaults to None.
         stream (int, optional): The zero indexed stream to use post-source mapping. Defaults to None.
-        options (dict): `ffmpeg` options associated with the stream type for processing.
+        options (dict): `ffmpeg` options associated with the stream type for processing.  Nested option values
+            (e.g. `x265-params`) are flattened into `key=value:key=value` strings when set.
         option_set (str): The title of a set of options to be loaded from a remote location. Defaults to None.
     """
+    __slots__ = ("specifier", "stream", "__options", "option_set")
+
     specifier: Optional[str]
     stream: Optional[int]
-    options: dict
     option_set: str
+    __options: dict
 
     def __init__(
         self, specifier: Optional[str] = None, stream: Optional[int] = None, options: Optional[dict] = None, option_set: str = None
@@ -90,12 +293,30 @@ class OutputMap:
         """
         self.specifier = specifier[0].lower() if specifier else None
         self.stream = stream
-        if options:
-            self.options = options
-        else:
-            self.options = dict()
+        self.options = options
         self.option_set = option_set
 
+    @property
+    def options(self) -> dict:
+        """Return the `ffmpeg` options associated with the output map.
+
+        Returns:
+            dict: The `ffmpeg` options with any nested values already flattened.
+        """
+        return self.__options
+
+    @options.setter
+    def options(self, options: Optional[dict]) -> None:
+        """Sets the `ffmpeg` options, flattening nested option values into `key=value` strings.
+
+        Args:
+            options (dict, optional): `ffmpeg` options associated with the stream type for processing.
+        """
+        self.__options = {
+            k: ":".join(f"{i}={j}" for i, j in v.items()) if isinstance(v, (dict, Box)) else v
+            for k, v in (options or dict()).items()
+        }
+
     @property
     def cli_options(self):
         """Returns the CLI options associated with the output map.
@@ -103,24 +324,26 @@ class OutputMap:
         Returns:
             str: The CLI options for the `ffmpeg` output map.
         """
-        command = ""
+        return ' '.join(self.cli_argv)
+
+    @property
+    def cli_argv(self) -> List[str]:
+        """Returns the CLI options associated with the output map as separate arguments.
+
+        Returns:
+            List[str]: The CLI arguments for the `ffmpeg` output map.
+        """
+        argv = list()
         template = list()
         if self.specifier is not None:
             template.append(f"{self.specifier}")
         if self.stream is not None:
             template.append(f"{self.stream}")
         template = ":".join(template)
-        for k, v in self.options.items():
-            if template:
-                has_template = ":"
-            else:
-                has_template = ""
-            if type(v) in [dict, Box]:
-                i = ":".join([f"{i}={j}" for i, j in v.items()])
-                command += f"-{k}{has_template}{template} {i} "
-            else:
-                command += f"-{k}{has_template}{template} {v} "
-        return command.strip()
+        has_template = ":" if template else ""
+        for k, v in self.__options.items():
+            argv.extend((f"-{k}{has_template}{template}", str(v)))
+        return argv
 
 
 class FfmpegMiscSettings:
@@ -132,6 +355,8 @@ class FfmpegMiscSettings:
         video_info (StreamInfo, optional): Used to populate frame information from the video track. Defaults to None.
     """
 
+    __slots__ = ("overwrite", "progress_bar", "video_info")
+
     overwrite: bool
     progress_bar: bool
     video_info: Optional[StreamInfo]
@@ -161,6 +386,9 @@ class Ffmpeg:
     output_maps: List[OutputMap]
     settings: FfmpegMiscSettings
     __output: Union[str, Path]
+    __output_absolute: str
+    __ffmpeg_path: Path
+    __ffmpeg_binary: str
 
     def __init__(self, ffmpeg_path: Path = None):
         """Initialize a new Ffmpeg instance.
@@ -169,10 +397,10 @@ class Ffmpeg:
             ffmpeg_path (Path, optional): The location of the `ffmpeg` binary. Defaults to None.
         """
         if ffmpeg_path:
-            self.ffmpeg_path = Path(ffmpeg_path)
+            self.ffmpeg_path = ffmpeg_path
         else:
             binary = "ffmpeg.exe" if platform.system() == "Windows" else "ffmpeg"
-            self.ffmpeg_path = Path(shutil.which(binary))
+            self.ffmpeg_path = _resolve_ffmpeg(binary)
         self.sources = list()
         self.source_maps = list()
         self.schema_path = Path(os.path.dirname(os.path.abspath(__file__)))
@@ -190,10 +418,7 @@ class Ffmpeg:
             jsonschema.ValidationError: If the JSON file does not pass validation.
         """
 
-        file_path = Path(file_path)
-        with file_path.open('r') as f:
-            data = Box(json.load(f))
-
+        data = _json_loads(Path(file_path).read_bytes())
         self.load_from_object(data)
 
     def load_from_object(self, data: Union[Box, dict]) -> None:
@@ -205,18 +430,10 @@ class Ffmpeg:
         Raises:
             jsonschema.ValidationError: If the data does not pass validation.
         """
-        schema = Path("schema/ffmpeg.schema.json")
-        schema = self.schema_path / schema
-        with schema.open('r') as f:
-            schema_data = json.load(f)
-
-        jsonschema.validate(data, schema_data)
+        _get_validator(self.schema_path / "schema/ffmpeg.schema.json").validate(data)
 
         data = Box(data)
-        try:
-            self.settings.overwrite = data.overwrite
-        except box.exceptions.BoxKeyError:
-            pass
+        self.settings.overwrite = data.get("overwrite", self.settings.overwrite)
         self.sources = data.sources
         self.output_file = data.output_file
         self.source_maps = [SourceMap(**i) for i in data.source_maps]
@@ -231,19 +448,30 @@ class Ffmpeg:
         """Generate the entire `ffmpeg` command to include command-line options.
 
         Returns:
-            str: The entire `ffmpeg` command to run.
+            str: The entire `ffmpeg` command to run, quoted for display.
+        """
+        return shlex.join(self.generate_argv())
+
+    def generate_argv(self) -> List[str]:
+        """Generate the `ffmpeg` command as an argument list that can be passed straight to `subprocess`.
+
+        Returns:
+            List[str]: The `ffmpeg` binary followed by all of the command-line options.
         """
         command = list()
-        command.append(f'"{self.ffmpeg_path}"')
+        command.append(self.__ffmpeg_binary)
         if self.settings.overwrite:
             command.append("-y")
         command.extend(self.generate_main_options())
         command.extend(["-progress", "pipe:1"])
-        [command.append(f'-i "{i}"') for i in self.sources]
-        [command.extend(i.cli_options.split()) for i in self.source_maps]
-        [command.extend(i.cli_options.split()) for i in self.output_maps]
-        command.append(f'"{str(self.output_file.absolute())}"')
-        return ' '.join(command)
+        for i in self.sources:
+            command.extend(("-i", str(i)))
+        for i in self.source_maps:
+            command.extend(i.cli_argv)
+        for i in self.output_maps:
+            command.extend(i.cli_argv)
+        command.append(self.__output_absolute)
+        return command
 
     def generate_main_options(self) -> list:
         """Generate the command-line options from the input options.
@@ -265,7 +493,7 @@ class Ffmpeg:
         Args:
             verbose (bool, optional): Display progress and additional statistics during the encode. Defaults to False.
         """
-        command = shlex.split(self.generate_command())
+        command = self.generate_argv()
         if verbose:
             subprocess.run(command)
             return
@@ -275,40 +503,46 @@ class Ffmpeg:
 
         if self.settings.progress_bar and self.settings.video_info:
             frames = self.settings.video_info.frames
-            progress = Progress(
-                TextColumn("[#ffff00]»[bold green] encode"),
-                BarColumn(
-                    bar_width=None,
-                ),
-                "[progress.percentage]{task.percentage:>3.1f}%",
-                "•",
-                "[green]{task.completed}/{task.total}[/green]",
-                "•",
-                TimeRemainingColumn(),
-            )
+            progress = _progress_bar()
             progress.start()
-            task = progress.add_task("test")
-            progress.update(task, total=frames)
-            process = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-            )
-
-            regex = r"frame=(\s*\d+)"
-            while True:
-                time.sleep(0.05)
-                output = process.stdout.readline()
-                if process.poll() is not None:
-                    break
-                if output:
-                    if m := re.search(regex, output.decode()):
-                        progress.update(task, completed=int(m.group(1)))
+            task = progress.add_task("encode", total=frames)
+            process = self.spawn()
+
+            reader = threading.Thread(target=self._pump, args=(process, progress, task), daemon=True)
+            reader.start()
+            process.wait()
+            reader.join()
+            process.stdout.close()
             progress.update(task, completed=frames)
             progress.stop()
             return
 
         subprocess.call(command, stdout=subprocess.DEVNULL,
                         stderr=subprocess.DEVNULL)
-        
+
+    def spawn(self) -> subprocess.Popen:
+        """Start the `ffmpeg` encode in the background with its `-progress` output piped to `stdout`.
+
+        Returns:
+            subprocess.Popen: The running `ffmpeg` process.
+        """
+        return subprocess.Popen(
+            self.generate_argv(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+
+    @staticmethod
+    def _pump(process: subprocess.Popen, progress: "Progress", task: "TaskID") -> None:
+        """Read the `-progress` output of a running encode and forward the frame count to the progress bar.
+
+        Args:
+            process (subprocess.Popen): The running `ffmpeg` process.
+            progress (Progress): The progress bar to update.
+            task (TaskID): The progress bar task associated with the encode.
+        """
+        for raw in process.stdout:
+            if (frame := _parse_frame(raw)) is not None:
+                progress.update(task, completed=frame)
+
     def get_primary_video_information(self) -> Optional[StreamInfo]:
         """Parse all of the sources maps and return the video stream information if present.
 
@@ -318,8 +552,17 @@ class Ffmpeg:
         if not self.source_maps or not self.sources:
             return None
         
-        for source_map in self.source_maps:
-            info = Ffprobe(self.sources[source_map.source])
+        # Only maps that can select a video stream are worth probing.
+        video_maps = [i for i in self.source_maps if not i.specifier or i.specifier == "v"]
+        if not video_maps:
+            return None
+
+        unique_sources = {i.source: self.sources[i.source] for i in video_maps}
+        with ThreadPoolExecutor(max_workers=min(8, len(unique_sources))) as executor:
+            probes = dict(zip(unique_sources, executor.map(_probe, unique_sources.values())))
+
+        for source_map in video_maps:
+            info = probes[source_map.source]
             if not source_map.specifier:
                 s: StreamInfo = info.get_streams()[source_map.stream]
                 if s.stream_type == "video":
@@ -348,6 +591,91 @@ class Ffmpeg:
             path (Union[str, Path]): The path to use for the output file.
         """
         self.__output = Path(path)
+        self.__output_absolute = str(self.__output.absolute())
+
+    @property
+    def ffmpeg_path(self) -> Path:
+        """Return the location of the `ffmpeg` binary.
+
+        Returns:
+            Path: The location of the `ffmpeg` binary.
+        """
+        return self.__ffmpeg_path
+
+    @ffmpeg_path.setter
+    def ffmpeg_path(self, path: Union[str, Path]) -> None:
+        """Sets the location of the `ffmpeg` binary.
+
+        Args:
+            path (Union[str, Path]): The path to the `ffmpeg` binary.
+        """
+        self.__ffmpeg_path = Path(path)
+        self.__ffmpeg_binary = str(self.__ffmpeg_path)
+
+
+def run_batch(jobs: List[Ffmpeg]) -> None:
+    """Run several `ffmpeg` encodes at the same time and display the progress of each one.
+
+    The `-progress` output of every encode is read from a single thread using a selector.  On Windows, where
+    pipes cannot be used with selectors, each encode gets its own reader thread instead.
+
+    Args:
+        jobs (List[Ffmpeg]): The encodes to run.
+    """
+    for job in jobs:
+        if not job.settings.video_info:
+            job.settings.video_info = job.get_primary_video_information()
+
+    progress = _progress_bar()
+    progress.start()
+    running = list()
+    try:
+        for idx, job in enumerate(jobs):
+            frames = job.settings.video_info.frames if job.settings.video_info else None
+            task = progress.add_task(f"encode {idx}", total=frames)
+            running.append((job.spawn(), task, frames))
+
+        if platform.system() == "Windows":
+            readers = [
+                threading.Thread(target=Ffmpeg._pump, args=(process, progress, task), daemon=True)
+                for process, task, _ in running
+            ]
+            for reader in readers:
+                reader.start()
+            for reader in readers:
+                reader.join()
+        else:
+            with selectors.DefaultSelector() as selector:
+                for process, task, _ in running:
+                    selector.register(process.stdout, selectors.EVENT_READ, (task, bytearray()))
+                while selector.get_map():
+                    for key, _ in selector.select():
+                        task, buffer = key.data
+                        chunk = os.read(key.fd, 65536)
+                        if not chunk:
+                            selector.unregister(key.fileobj)
+                            continue
+                        buffer.extend(chunk)
+                        *lines, remainder = buffer.split(b"\n")
+                        buffer[:] = remainder
+                        for line in lines:
+                            if (frame := _parse_frame(line)) is not None:
+                                progress.update(task, completed=frame)
+
+        for process, task, frames in running:
+            process.wait()
+            if frames:
+                progress.update(task, completed=frames)
+    except BaseException:
+        # Don't leave encodes running unsupervised if spawning or reading fails, or the user interrupts.
+        for process, _, _ in running:
+            process.terminate()
+        raise
+    finally:
+        for process, _, _ in running:
+            process.wait()
+            process.stdout.close()
+        progress.stop()
 
 
 if __name__ == "__main__":
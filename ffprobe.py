@@ -1,23 +1,109 @@
-import json
+import os
 import platform
 import shutil
 import subprocess
-from dataclasses import dataclass
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache
 from pathlib import Path
-from typing import List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-from box import Box
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
 
+_FRAME_KEYS = ("nb_read_frames", "nb_frames")
+_COUNTED_STREAM_TYPES = ("video", "audio", "subtitle")
+_STREAM_ENTRIES = (
+    "stream=codec_name,codec_long_name,codec_type,bit_rate,nb_frames,nb_read_frames,channels"
+    ":stream_disposition=default,forced"
+    ":stream_tags"
+)
 
-@dataclass
+
+def _first(mapping: dict, keys: Tuple[str, ...]) -> Optional[str]:
+    """Return the value of the first key in priority order that is present in the mapping.
+
+    Args:
+        mapping (dict): The mapping to search.
+        keys (Tuple[str, ...]): The keys to look for, highest priority first.
+
+    Returns:
+        Optional[str]: The value of the first key found. Defaults to None.
+    """
+    for key in keys:
+        if (value := mapping.get(key)) is not None:
+            return value
+    return None
+
+
+def _tag(tags: dict, name: str) -> Optional[str]:
+    """Return a statistics tag, which Matroska files may suffix with a language (e.g. `BPS-eng`).
+
+    Args:
+        tags (dict): The tags of the stream.
+        name (str): The name of the tag without any suffix.
+
+    Returns:
+        Optional[str]: The value of the tag. Defaults to None.
+    """
+    if name in tags:
+        return tags[name]
+    for key, value in tags.items():
+        if key.startswith(name):
+            return value
+    return None
+
+
+def _missing_frames(streams: List["StreamInfo"]) -> List["StreamInfo"]:
+    """Return the streams that should have a frame count but don't report one.
+
+    Args:
+        streams (List[StreamInfo]): The streams of the media file.
+
+    Returns:
+        List[StreamInfo]: The video, audio and subtitle streams without a frame count.
+    """
+    return [i for i in streams if i.frames is None and i.stream_type in _COUNTED_STREAM_TYPES]
+
+
+def _merge_frame_counts(streams: List["StreamInfo"], output: bytes) -> None:
+    """Fill in the missing frame counts from the output of an `ffprobe -count_frames` run.
+
+    Args:
+        streams (List[StreamInfo]): The streams of the media file, updated in place.
+        output (bytes): The JSON output of the `ffprobe -count_frames` run.
+    """
+    counted = {i["index"]: i.get("nb_read_frames") for i in _json_loads(output)["streams"]}
+    for stream in _missing_frames(streams):
+        if frames := counted.get(stream.stream):
+            stream.frames = int(frames)
+
+
+@lru_cache(maxsize=4)
+def _resolve_ffprobe(binary: str) -> Path:
+    """Find an `ffprobe` binary on the PATH, only scanning the PATH the first time a binary is looked up.
+
+    Args:
+        binary (str): The name of the `ffprobe` binary.
+
+    Returns:
+        Path: The location of the `ffprobe` binary.
+    """
+    return Path(shutil.which(binary))
+
+
+@dataclass(slots=True)
 class StreamInfo:
-    """A container for specific track information from the MediaInfo library
+    """A container for specific stream information from `ffprobe`
 
     Attributes:
         codec (str): The CODEC associated with the track
-        codec_long (str): The long description of the codec
-        track (int): The zero-index track value of the media file
-        language (str): The two character language code of the track
+        codec_long (str, optional): The long description of the codec. Defaults to None.
+        stream (int): The zero-index stream value of the media file
+        language (str): The language code of the track
         bitrate (int, optional): The bitrate of the track. Defaults to None.
         forced (bool): Whether the track is forced
         default (bool): Whether the track is selected by default
@@ -34,7 +120,7 @@ class StreamInfo:
     default: bool
     frames: Optional[int]
     stream_type: str
-    codec_long: str = None
+    codec_long: Optional[str] = None
     title: Optional[str] = None
     channels: Optional[int] = None
 
@@ -43,93 +129,233 @@ class Ffprobe:
     """A class to grab stream information via `ffprobe` for media files.
 
     Attributes:
-        count_streams (bool): Whether to have `ffprobe` count the frames of the streams in the file manually. Defaults to False.
+        count_frames (bool): Whether to have `ffprobe` count the frames of streams that don't report a frame count. Defaults to False.
         ffprobe_path (Path): The location of the `ffprobe` binary.
         media_path (Path): The location of the media file to get the information from.
         streams (List[StreamInfo]): The stream information associated with the media file.
+        streams_by_type (Dict[str, List[StreamInfo]]): The stream information grouped by stream type.
     """
 
     count_frames: bool = False
     ffprobe_path: Path
     media_path: Path
-    streams: List[StreamInfo]
 
     def __init__(self, media_path: Union[str, Path], ffprobe_path: Union[str, Path] = None, count_frames: bool = False):
-        """Create an instance of the `Ffprobe` class.
+        """Create an instance of the `Ffprobe` class.  `ffprobe` isn't run until the streams are first needed.
 
         Args:
             media_path (Union[str, Path]): The path to the media file to analyze.
             ffprobe_path (Union[str, Path], optional): The path to the `ffprobe` binary. Defaults to None.
-            count_frames (bool, optional): Whether to have `ffprobe` count the frames of the embedded streams. Defaults to False.
+            count_frames (bool, optional): Whether to have `ffprobe` count the frames of streams that don't report a frame count. Defaults to False.
+        """
+        self._configure(media_path, ffprobe_path, count_frames)
+
+    @classmethod
+    def probe_many(
+        cls, media_paths: List[Union[str, Path]], ffprobe_path: Union[str, Path] = None, count_frames: bool = False,
+        max_processes: Optional[int] = None
+    ) -> List["Ffprobe"]:
+        """Probe several media files at once, running the `ffprobe` processes concurrently.
+
+        The probes run on their own event loop.  If this is called from code that's already running an event loop
+        (e.g. Jupyter or an async application), that loop is blocked until all of the probes finish.
+
+        Args:
+            media_paths (List[Union[str, Path]]): The paths to the media files to analyze.
+            ffprobe_path (Union[str, Path], optional): The path to the `ffprobe` binary. Defaults to None.
+            count_frames (bool, optional): Whether to have `ffprobe` count the frames of streams that don't report a frame count. Defaults to False.
+            max_processes (int, optional): The maximum number of `ffprobe` processes to run at once. Defaults to the CPU count.
+
+        Returns:
+            List[Ffprobe]: An `Ffprobe` instance for each media file, in the same order as `media_paths`.
+        """
+        probes = list()
+        for media_path in media_paths:
+            probe = cls.__new__(cls)
+            probe._configure(media_path, ffprobe_path, count_frames)
+            probes.append(probe)
+
+        max_processes = max_processes or os.cpu_count() or 1
+        outputs = cls._run_many([i.command_options for i in probes], max_processes)
+        results = [probe._parse_streams(output) for probe, output in zip(probes, outputs)]
+
+        counts = list()
+        for probe, streams in zip(probes, results):
+            if probe.count_frames and (command := probe._count_frames_command(streams)):
+                counts.append((streams, command))
+        if counts:
+            outputs = cls._run_many([command for _, command in counts], max_processes)
+            for (streams, _), output in zip(counts, outputs):
+                _merge_frame_counts(streams, output)
+
+        for probe, streams in zip(probes, results):
+            probe.streams = streams
+        return probes
+
+    @staticmethod
+    def _run_many(commands: List[List[str]], max_processes: int) -> List[bytes]:
+        """Run several `ffprobe` commands concurrently and collect their output.
+
+        Args:
+            commands (List[List[str]]): The `ffprobe` commands to run.
+            max_processes (int): The maximum number of `ffprobe` processes to run at once.
+
+        Raises:
+            subprocess.CalledProcessError: If any of the `ffprobe` processes fail.
+
+        Returns:
+            List[bytes]: The output of each command, in the same order as `commands`.
+        """
+        import asyncio
+
+        async def run_all() -> List[bytes]:
+            semaphore = asyncio.Semaphore(max_processes)
+
+            async def run(command: List[str]) -> bytes:
+                async with semaphore:
+                    process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+                    output, _ = await process.communicate()
+                if process.returncode:
+                    raise subprocess.CalledProcessError(process.returncode, command, output)
+                return output
+
+            return await asyncio.gather(*(run(i) for i in commands))
+
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(run_all())
+
+        # `asyncio.run` can't be nested inside a running loop, so give the probes a loop on another thread.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(asyncio.run, run_all()).result()
+
+    def _configure(self, media_path: Union[str, Path], ffprobe_path: Union[str, Path], count_frames: bool) -> None:
+        """Set up the binary and media file locations without running `ffprobe`.
+
+        Args:
+            media_path (Union[str, Path]): The path to the media file to analyze.
+            ffprobe_path (Union[str, Path]): The path to the `ffprobe` binary.
+            count_frames (bool): Whether to have `ffprobe` count the frames of streams that don't report a frame count.
         """
         if ffprobe_path:
             self.ffprobe_path = Path(ffprobe_path)
         else:
             binary = "ffprobe.exe" if platform.system() == "Windows" else "ffprobe"
-            self.ffprobe_path = Path(shutil.which(binary))
+            self.ffprobe_path = _resolve_ffprobe(binary)
         self.media_path = Path(media_path)
         self.count_frames = count_frames
-        self.streams = self.process_media()
+        self._streams: Optional[List[StreamInfo]] = None
+        self._streams_by_type: Optional[Dict[str, List[StreamInfo]]] = None
+
+    @property
+    def streams(self) -> List[StreamInfo]:
+        """Return the stream information of the media file, running `ffprobe` the first time it's needed.
+
+        Returns:
+            List[StreamInfo]: The stream information associated with the media file.
+        """
+        # A plain attribute rather than `cached_property`, whose per-class lock would serialize probes run on
+        # worker threads.
+        if self._streams is None:
+            self._streams = self.process_media()
+        return self._streams
 
-    def process_media(self) -> List[StreamInfo]:
+    @streams.setter
+    def streams(self, streams: List[StreamInfo]) -> None:
+        self._streams = streams
+        self._streams_by_type = None
+
+    @property
+    def command_options(self) -> List[str]:
+        """Returns the `ffprobe` command used to get the stream information.
+
+        Returns:
+            List[str]: The `ffprobe` binary followed by all of the command-line options.
+        """
+        command_options = [str(self.ffprobe_path), "-v", "quiet", "-show_entries",
+                           _STREAM_ENTRIES, "-print_format", "json=compact=1"]
+        command_options.append(str(self.media_path))
+        return command_options
+
+    def process_media(self, output: Optional[bytes] = None) -> List[StreamInfo]:
         """Process the streams of the media file and return the information
 
+        Args:
+            output (bytes, optional): Output already collected from `ffprobe`. Runs `ffprobe` when None. Defaults to None.
+
         Returns:
             List[StreamInfo]: A list of StreamInfo objects containing the stream information.
         """
-        command_options = [str(self.ffprobe_path), "-v",
-                           "quiet", "-show_streams", "-print_format", "json"]
-        if self.count_frames:
-            command_options.append("-count_frames")
-        command_options.append(str(self.media_path))
-        output = Box(json.loads(subprocess.check_output(command_options)))
+        if output is None:
+            output = subprocess.check_output(self.command_options)
+        streams = self._parse_streams(output)
+
+        if self.count_frames and (command := self._count_frames_command(streams)):
+            _merge_frame_counts(streams, subprocess.check_output(command))
+        return streams
+
+    def _parse_streams(self, output: bytes) -> List[StreamInfo]:
+        """Parse the stream information out of the `ffprobe` output.
+
+        Args:
+            output (bytes): The JSON output of `ffprobe`.
+
+        Returns:
+            List[StreamInfo]: A list of StreamInfo objects containing the stream information.
+        """
+        output = _json_loads(output)
 
         streams = list()
-        for idx, stream in enumerate(output.streams):
-            lang = stream.tags.get("language", None) if "tags" in stream.keys() else None
-
-            if "bit_rate" in stream.keys():
-                bitrate = stream.bit_rate
-            elif "tags" in stream.keys():
-                tags = [i for i in stream.tags.keys() if i.startswith('BPS')]
-                if tags:
-                    bitrate = getattr(stream.tags, tags[0])
-                else:
-                    bitrate = None
-            else:
-                bitrate = None
-
-            if "nb_read_frames" in stream.keys():
-                frames = stream.nb_read_frames
-            elif "nb_frames" in stream.keys():
-                frames = stream.nb_frames
-            elif "tags" in stream.keys():
-                tags = [i for i in stream.tags.keys() if i.startswith('NUMBER_OF_FRAMES')]
-                if tags:
-                    frames = getattr(stream.tags, tags[0])
-                else:
-                    frames = None
-            else:
-                frames = None
+        for idx, stream in enumerate(output["streams"]):
+            tags = stream.get("tags") or dict()
+            lang = tags.get("language", None)
+
+            bitrate = stream.get("bit_rate") or _tag(tags, "BPS")
+            frames = _first(stream, _FRAME_KEYS) or _tag(tags, "NUMBER_OF_FRAMES")
 
             streams.append(
                 StreamInfo(
-                    codec_long=stream.codec_long_name,
-                    codec=stream.codec_name,
+                    codec_long=stream["codec_long_name"],
+                    codec=stream["codec_name"],
                     stream=idx,
                     language=lang,
                     bitrate=int(bitrate) if bitrate else None,
-                    forced=bool(stream.disposition.forced),
-                    default=bool(stream.disposition.default),
+                    forced=bool(stream["disposition"]["forced"]),
+                    default=bool(stream["disposition"]["default"]),
                     frames=int(frames) if frames else None,
-                    stream_type=stream.codec_type,
-                    title=getattr(stream.tags, "title",
-                                  None) if "tags" in stream.keys() else None,
-                    channels=getattr(stream, "channels", None),
+                    stream_type=stream["codec_type"],
+                    title=tags.get("title", None),
+                    channels=stream.get("channels", None),
                 )
             )
+
         return streams
 
+    def _count_frames_command(self, streams: List[StreamInfo]) -> Optional[List[str]]:
+        """Build the `ffprobe` command that counts the frames of streams that don't report a frame count.
+
+        Counting frames means demuxing the entire file, so it's only done when a video, audio or subtitle stream
+        is missing its frame count, and only for that stream when it's the only one missing.  Streams that never
+        have frames (attachments, data) are ignored.
+
+        Args:
+            streams (List[StreamInfo]): The streams of the media file.
+
+        Returns:
+            Optional[List[str]]: The `ffprobe` command, or None if no stream needs its frames counted.
+        """
+        missing = _missing_frames(streams)
+        if not missing:
+            return None
+
+        command_options = [str(self.ffprobe_path), "-v", "quiet", "-count_frames", "-show_entries",
+                           "stream=index,nb_read_frames", "-print_format", "json=compact=1"]
+        if len(missing) == 1:
+            command_options.extend(("-select_streams", str(missing[0].stream)))
+        command_options.append(str(self.media_path))
+        return command_options
+
     def get_streams(self, stream_type: str = "all") -> List[StreamInfo]:
         """Get all of the streams or all of the streams associated with a given stream type.
 
@@ -137,18 +363,26 @@ class Ffprobe:
             stream_type (str, optional): The category of streams to get. Defaults to "all".
 
         Returns:
-            List[StreamInfo]: A list of StreamInfo objects containing the stream data.
+            List[StreamInfo]: A list of StreamInfo objects containing the stream data.  These are copies, so they can
+                be changed without affecting later calls.
         """
-        if stream_type != "all":
-            streams = [i for i in self.streams if i.stream_type == stream_type]
-        else:
-            streams = self.streams
+        streams = self.streams if stream_type == "all" else self.streams_by_type.get(stream_type, ())
+        return [replace(stream) for stream in streams]
+
+    @property
+    def streams_by_type(self) -> Dict[str, List[StreamInfo]]:
+        """Return the streams grouped by stream type, zero indexed within each type.
 
-        new_streams = list()
-        for idx, stream in enumerate(streams):
-            stream.stream = idx
-            new_streams.append(stream)
-        return new_streams
+        Returns:
+            Dict[str, List[StreamInfo]]: The streams of each stream type.
+        """
+        if self._streams_by_type is None:
+            streams_by_type = defaultdict(list)
+            for stream in self.streams:
+                streams = streams_by_type[stream.stream_type]
+                streams.append(replace(stream, stream=len(streams)))
+            self._streams_by_type = dict(streams_by_type)
+        return self._streams_by_type
 
 
 if __name__ == "__main__":